@@ -20,13 +20,24 @@ Part of Agent Guard (https://agentguard.co)
 
 import os
 import json
-import hashlib
+import mmap
+import re
+import struct
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 # Optional: LLMLingua compression
 try:
@@ -35,6 +46,59 @@ try:
 except ImportError:
     HAS_LLMLINGUA = False
 
+# Loaded embedding models, shared by every retriever in the process
+_MODEL_CACHE: dict[str, "SentenceTransformer"] = {}
+
+# Query embeddings keyed by (id(model), query); bounded LRU
+_QUERY_CACHE: "OrderedDict[tuple[int, str], np.ndarray]" = OrderedDict()
+_QUERY_CACHE_SIZE = 256
+_QUERY_CACHE_LOCK = threading.Lock()
+
+# HNSW graph parameters; stale rows are rebuilt away past TOMBSTONE_REBUILD_RATIO
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+TOMBSTONE_REBUILD_RATIO = 0.2
+
+# Below this size a single query is cheaper single-threaded than via the OpenMP pool
+FAISS_THREADS_ENV = "AGENTGUARD_FAISS_THREADS"
+SINGLE_THREAD_SEARCH_MAX = 50_000
+
+# Warm compressor server (see ContextCompressor.serve / RemoteCompressor)
+COMPRESSOR_URL_ENV = "AGENTGUARD_COMPRESSOR_URL"
+DEFAULT_COMPRESSOR_PORT = 8012
+
+# chunks-<gen>.bin: header (magic, chunk count, heap bytes), one record per chunk,
+# then the UTF-8 text heap. Each save writes index-<gen>.faiss and chunks-<gen>.bin
+# under a fresh generation and commits them by replacing meta.json last.
+_CBI_MAGIC = b"CBI2"
+_CBI_HEADER = struct.Struct("<4sIQ")
+_CBI_RECORD = struct.Struct("<IIII")  # source_id, start, text_off, text_len
+_LOAD_ATTEMPTS = 5
+
+
+class MappedChunks(Sequence):
+    """Read-only chunk list backed by an mmapped chunks file (records + text heap)."""
+
+    def __init__(self, records: np.ndarray, strings, heap_start: int, sources: list[str]):
+        self._records = records
+        self._strings = strings
+        self._heap_start = heap_start
+        self._sources = sources
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        source_id, start, off, length = (int(v) for v in self._records[i])
+        off += self._heap_start
+        return {
+            "text": self._strings[off:off + length].decode("utf-8"),
+            "source": self._sources[source_id],
+            "start": start,
+        }
+
 
 class ContextRetriever:
     """FAISS-based semantic search over text chunks."""
@@ -45,58 +109,195 @@ class ContextRetriever:
         chunk_size: int = 512,
         chunk_overlap: int = 50,
     ):
-        self.model = SentenceTransformer(model_name)
-        self.dim = self.model.get_sentence_embedding_dimension()
+        self.model_name = model_name
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         
-        self.index = faiss.IndexFlatIP(self.dim)
-        self.chunks: list[dict] = []
-        self.file_hashes: dict[str, str] = {}
+        self._model: Optional["SentenceTransformer"] = None
+        self._index: Optional[faiss.Index] = None
+        self._mapped = False
+        self.chunks: Sequence[dict] = []
+        self.file_hashes: dict[str, tuple[int, int]] = {}
+        self._sources: list[str] = []
+        # Index rows of superseded chunks; HNSW cannot delete, so search skips them
+        self._tombstones: set[int] = set()
+        self._tombstone_selector: Optional[faiss.IDSelector] = None
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        """Lazy-load the embedding model (shared across instances)."""
+        if self._model is None:
+            model = _MODEL_CACHE.get(self.model_name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(self.model_name)
+                _MODEL_CACHE[self.model_name] = model
+            self._model = model
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        """Embedding dimension, from the loaded index if any, else the model."""
+        if self._index is not None:
+            return self._index.d
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def index(self) -> faiss.Index:
+        """FAISS index, created empty on first use."""
+        if self._index is None:
+            self._index = self._new_index()
+        return self._index
+
+    @index.setter
+    def index(self, value: faiss.Index):
+        self._index = value
+        self._mapped = False
+
+    def _ensure_writable(self):
+        """Swap a memory-mapped index for an in-memory copy before adds (add() on it aborts)."""
+        if self._mapped:
+            # Copy the mapped object itself: the file may since have been replaced by a
+            # newer save, whose rows would not match self.chunks. clone_index keeps the
+            # mapped view, so round-trip through an in-memory serialization instead.
+            self.index = faiss.deserialize_index(faiss.serialize_index(self._index))
+
+    def _new_index(self) -> faiss.Index:
+        """HNSW graph over int8 scalar-quantized vectors, inner product (cosine)."""
+        index = faiss.IndexHNSWSQ(
+            self.dim,
+            faiss.ScalarQuantizer.QT_8bit_uniform,
+            HNSW_M,
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
 
     def _chunk_text(self, text: str, source: str) -> list[dict]:
-        """Split into overlapping chunks."""
-        words = text.split()
+        """Split into overlapping chunks, sliced from the original text."""
+        spans = [m.span() for m in re.finditer(r"\S+", text)]
         chunks = []
         
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            if len(chunk_words) < 20:
+        for i in range(0, len(spans), self.chunk_size - self.chunk_overlap):
+            j = min(i + self.chunk_size, len(spans)) - 1
+            if j - i + 1 < 20:
                 continue
             chunks.append({
-                "text": " ".join(chunk_words),
+                "text": text[spans[i][0]:spans[j][1]],
                 "source": source,
                 "start": i,
             })
         return chunks
 
-    def index_file(self, path: str, force: bool = False) -> int:
-        """Index a file. Returns chunks added."""
-        path = str(Path(path).resolve())
+    def _collect_chunks(
+        self, path: str, force: bool = False
+    ) -> tuple[list[dict], Optional[tuple[int, int]]]:
+        """Read and chunk a file without encoding. Returns (chunks, fingerprint)."""
+        st = os.stat(path)
+        fingerprint = (st.st_mtime_ns, st.st_size)
+        
+        if not force and self.file_hashes.get(path) == fingerprint:
+            return [], None
         
+        # Plain read, not mmap: a file truncated by another writer mid-read must not SIGBUS
         with open(path, "rb") as f:
-            current_hash = hashlib.md5(f.read()).hexdigest()
+            text = f.read().decode("utf-8", "ignore")
         
-        if not force and self.file_hashes.get(path) == current_hash:
-            return 0
+        return self._chunk_text(text, path), fingerprint
+
+    def _encode(self, texts: list[str]) -> np.ndarray:
+        """Encode texts sorted by length to minimize padding, in original order."""
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        embeddings = self.model.encode(
+            [texts[i] for i in order],
+            batch_size=64,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            convert_to_tensor=False,
+            normalize_embeddings=True,
+        )
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        # Fancy indexing already yields a fresh C-contiguous array; only cast if needed
+        return np.ascontiguousarray(embeddings[inverse], dtype=np.float32)
+
+    def _add_files(self, files: list[tuple[str, tuple[int, int], list[dict]]]) -> int:
+        """Encode chunks from many files in one batch and add to the index."""
+        chunks = [c for _, _, file_chunks in files for c in file_chunks]
+        if chunks:
+            # Encode each distinct text once; repeated boilerplate reuses its row
+            rows: dict[str, int] = {}
+            slots = [rows.setdefault(c["text"], len(rows)) for c in chunks]
+            embeddings = self._encode(list(rows))
+            if len(rows) < len(chunks):
+                embeddings = embeddings[slots]
+            self._ensure_writable()
+            if not isinstance(self.chunks, list):
+                self.chunks = list(self.chunks)
+            
+            replaced = {path for path, _, _ in files if path in self.file_hashes}
+            self._tombstone_sources(replaced)
+            
+            if not self.index.is_trained:
+                self.index.train(embeddings)
+            self.index.add(embeddings)
+            self.chunks.extend(chunks)
+        else:
+            self._tombstone_sources({path for path, _, _ in files if path in self.file_hashes})
         
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            text = f.read()
+        for path, fingerprint, _ in files:
+            self.file_hashes[path] = fingerprint
         
-        chunks = self._chunk_text(text, path)
-        if not chunks:
-            return 0
+        if self._tombstones and len(self._tombstones) > TOMBSTONE_REBUILD_RATIO * self.index.ntotal:
+            self._rebuild()
         
-        embeddings = self.model.encode(
-            [c["text"] for c in chunks],
-            normalize_embeddings=True
+        return len(chunks)
+
+    def _tombstone_sources(self, sources: set[str]):
+        """Mark every live chunk from these sources as superseded."""
+        if not sources:
+            return
+        for row, chunk in enumerate(self.chunks):
+            if row not in self._tombstones and chunk["source"] in sources:
+                self._tombstones.add(row)
+        self._tombstone_selector = None
+
+    def _exclude_tombstones(self) -> Optional[faiss.IDSelector]:
+        """Selector rejecting tombstoned rows inside FAISS; cached until tombstones change."""
+        if not self._tombstones:
+            return None
+        if self._tombstone_selector is None:
+            batch = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64))
+            self._tombstone_selector = faiss.IDSelectorNot(batch)
+            self._tombstone_selector.referenced_objects = [batch]  # IDSelectorNot does not own batch
+        return self._tombstone_selector
+
+    def _rebuild(self):
+        """Drop tombstoned rows by rebuilding the index from the live vectors."""
+        self._ensure_writable()
+        live = np.array(
+            [row for row in range(self.index.ntotal) if row not in self._tombstones],
+            dtype=np.int64,
         )
+        index = self._new_index()
+        if len(live):
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)[live]
+            index.train(vectors)
+            index.add(vectors)
+        self.index = index
+        self.chunks = [self.chunks[int(row)] for row in live]
+        self._tombstones.clear()
+        self._tombstone_selector = None
+
+    def index_file(self, path: str, force: bool = False) -> int:
+        """Index a file. Returns chunks added."""
+        path = str(Path(path).resolve())
         
-        self.index.add(np.array(embeddings, dtype=np.float32))
-        self.chunks.extend(chunks)
-        self.file_hashes[path] = current_hash
+        chunks, fingerprint = self._collect_chunks(path, force)
+        if fingerprint is None:
+            return 0
         
-        return len(chunks)
+        return self._add_files([(path, fingerprint, chunks)])
 
     def index_directory(
         self,
@@ -105,8 +306,8 @@ class ContextRetriever:
         force: bool = False,
     ) -> int:
         """Index directory recursively."""
-        total = 0
         skip_dirs = {"node_modules", "__pycache__", ".venv", "venv", ".git", ".context-index"}
+        paths = []
         
         for path in Path(directory).rglob("*"):
             if not path.is_file():
@@ -117,58 +318,253 @@ class ContextRetriever:
                 continue
             if any(d in path.parts for d in skip_dirs):
                 continue
-            
+            paths.append(str(path.resolve()))
+        
+        def read_and_chunk(path: str):
             try:
-                total += self.index_file(str(path), force=force)
+                chunks, fingerprint = self._collect_chunks(path, force)
             except Exception as e:
                 print(f"Warning: {path}: {e}")
+                return None
+            # Keep changed files even with no chunks so their old chunks are retired
+            return (path, fingerprint, chunks) if fingerprint is not None else None
         
-        return total
+        # Reading and chunking are independent per file; FAISS writes stay on this thread
+        workers = min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = [r for r in pool.map(read_and_chunk, paths) if r is not None]
+        
+        return self._add_files(pending)
 
-    def search(self, query: str, k: int = 5, min_score: float = 0.3) -> list[dict]:
-        """Search for relevant chunks."""
-        if self.index.ntotal == 0:
-            return []
+    def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a query as a (1, dim) FP32 array, reusing recent results."""
+        key = (id(self.model), query)
+        with _QUERY_CACHE_LOCK:
+            embedding = _QUERY_CACHE.get(key)
+            if embedding is not None:
+                _QUERY_CACHE.move_to_end(key)
+                return embedding
         
-        embedding = self.model.encode([query], normalize_embeddings=True)
-        scores, indices = self.index.search(
-            np.array(embedding, dtype=np.float32),
-            min(k, self.index.ntotal)
+        embedding = np.ascontiguousarray(
+            self.model.encode(
+                [query],
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                convert_to_tensor=False,
+                normalize_embeddings=True,
+            ),
+            dtype=np.float32,
         )
+        embedding.setflags(write=False)
+        with _QUERY_CACHE_LOCK:
+            _QUERY_CACHE[key] = embedding
+            if len(_QUERY_CACHE) > _QUERY_CACHE_SIZE:
+                _QUERY_CACHE.popitem(last=False)
+        return embedding
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        min_score: float = 0.3,
+        ef_search: int = 64,
+    ) -> list[dict]:
+        """Search for relevant chunks. ef_search trades HNSW recall for speed."""
+        if self._index is None or self._index.ntotal == 0:
+            return []
         
-        results = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx >= 0 and score >= min_score:
-                chunk = self.chunks[idx].copy()
-                chunk["score"] = float(score)
-                results.append(chunk)
+        n = min(k, self.index.ntotal)
+        # Tombstoned rows are skipped during traversal, so they never take a result slot
+        selector = self._exclude_tombstones()
+        if isinstance(self.index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search, n), sel=selector)
+        elif selector is not None:
+            params = faiss.SearchParameters(sel=selector)
+        else:
+            params = None
+        embedding = self._embed_query(query)
+        if self.index.ntotal < SINGLE_THREAD_SEARCH_MAX:
+            threads = faiss.omp_get_max_threads()
+            faiss.omp_set_num_threads(1)
+            try:
+                scores, indices = self.index.search(embedding, n, params=params)
+            finally:
+                faiss.omp_set_num_threads(threads)
+        else:
+            scores, indices = self.index.search(embedding, n, params=params)
         
-        return results
+        keep = np.flatnonzero((indices[0] >= 0) & (scores[0] >= min_score))
+        return [
+            {**self.chunks[int(indices[0][j])], "score": float(scores[0][j])}
+            for j in keep
+        ]
 
     def save(self, path: str):
-        """Save index to disk."""
+        """Save index to disk as one snapshot; meta.json is replaced last to commit it."""
         path = Path(path)
         path.mkdir(parents=True, exist_ok=True)
-        faiss.write_index(self.index, str(path / "index.faiss"))
-        with open(path / "meta.json", "w") as f:
-            json.dump({"chunks": self.chunks, "hashes": self.file_hashes}, f)
+        generation = os.urandom(8).hex()
+        
+        faiss.write_index(self.index, str(path / f"index-{generation}.faiss"))
+        self._save_chunks(path / f"chunks-{generation}.bin")
+        with open(path / "meta.json.tmp", "w") as f:
+            json.dump({
+                "generation": generation,
+                "sources": self._sources,
+                "hashes": self.file_hashes,
+                "tombstones": sorted(self._tombstones),
+            }, f)
+        os.replace(path / "meta.json.tmp", path / "meta.json")
+        
+        # Older snapshots; processes that already mapped them keep a valid view
+        legacy = [path / "index.faiss", path / "chunks.bin", path / "strings.bin"]
+        for stale in [*path.glob("index-*.faiss"), *path.glob("chunks-*.bin"), *legacy]:
+            if generation not in stale.name and stale.exists():
+                stale.unlink()
+
+    def _save_chunks(self, path: Path):
+        """Write chunk records followed by their UTF-8 text heap."""
+        source_ids: dict[str, int] = {}
+        records = bytearray()
+        heap = bytearray()
+        
+        for chunk in self.chunks:
+            data = chunk["text"].encode("utf-8")
+            source_id = source_ids.setdefault(chunk["source"], len(source_ids))
+            records += _CBI_RECORD.pack(source_id, chunk["start"], len(heap), len(data))
+            heap += data
+        
+        with open(path, "wb") as f:
+            f.write(_CBI_HEADER.pack(_CBI_MAGIC, len(self.chunks), len(heap)))
+            f.write(records)
+            f.write(heap)
+        self._sources = list(source_ids)
+
+    def _load_chunks(self, path: Path, sources: list[str]) -> MappedChunks:
+        """Map a chunks file; chunk dicts are built on access."""
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            header = f.read(_CBI_HEADER.size)
+            if len(header) < _CBI_HEADER.size:
+                raise ValueError(f"{path}: truncated chunk index")
+            magic, count, heap_len = _CBI_HEADER.unpack(header)
+            heap_start = _CBI_HEADER.size + count * _CBI_RECORD.size
+            if magic != _CBI_MAGIC or size != heap_start + heap_len:
+                raise ValueError(f"{path}: not a valid chunk index")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        records = np.frombuffer(
+            data, dtype="<u4", count=count * 4, offset=_CBI_HEADER.size
+        ).reshape(count, 4)
+        return MappedChunks(records, data, heap_start, sources)
+
+    def _read_index(self, index_path: str) -> tuple[faiss.Index, bool]:
+        """Read an index, mapping its codes in place when faiss supports it."""
+        # faiss builds without IO_FLAG_MMAP_IFC read into memory
+        mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        try:
+            if mmap_flag is None:
+                return faiss.read_index(index_path), False
+            return faiss.read_index(index_path, mmap_flag), True
+        except RuntimeError:
+            # faiss reports a missing file as RuntimeError; surface it as such
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(index_path)
+            raise
 
     def load(self, path: str):
         """Load index from disk."""
         path = Path(path)
-        if (path / "index.faiss").exists():
-            self.index = faiss.read_index(str(path / "index.faiss"))
+        for attempt in range(_LOAD_ATTEMPTS):
+            try:
+                self._load_snapshot(path)
+                return
+            except FileNotFoundError:
+                # A concurrent save committed a newer snapshot and removed ours; reread
+                if attempt == _LOAD_ATTEMPTS - 1:
+                    raise
+
+    def _load_snapshot(self, path: Path):
+        """Load the snapshot named by meta.json (or a pre-generation layout)."""
+        data = {}
         if (path / "meta.json").exists():
             with open(path / "meta.json") as f:
                 data = json.load(f)
-                self.chunks = data.get("chunks", [])
-                self.file_hashes = data.get("hashes", {})
+        
+        generation = data.get("generation")
+        if generation is None:
+            # Indexes saved before snapshots: index.faiss with chunks inline in meta.json
+            index_path = path / "index.faiss"
+            index, mapped = self._read_index(str(index_path)) if index_path.exists() else (None, False)
+            chunks = data.get("chunks", [])
+            if index is not None and index.ntotal != len(chunks):
+                print(f"Warning: {path}: index does not match its chunks; re-index to rebuild")
+                return
+        else:
+            index, mapped = self._read_index(str(path / f"index-{generation}.faiss"))
+            chunks = self._load_chunks(path / f"chunks-{generation}.bin", data.get("sources", []))
+            if index.ntotal != len(chunks):
+                raise ValueError(f"{path}: index has {index.ntotal} rows but {len(chunks)} chunks")
+        
+        if index is not None:
+            self.index = index
+            self._mapped = mapped
+        self.chunks = chunks
+        self._sources = data.get("sources", [])
+        self.file_hashes = {
+            p: tuple(fp) for p, fp in data.get("hashes", {}).items()
+        }
+        self._tombstones = set(data.get("tombstones", []))
+        self._tombstone_selector = None
+
+
+# Fixed shapes the compiled compressor model is specialized for. LLMLingua-2 truncates
+# to 512 tokens and batches up to 50 slices, so every call fits one (batch, 512) bucket;
+# the 7 batch buckets stay under dynamo's default recompile limit of 8.
+COMPRESSOR_SEQ_LEN = 512
+COMPRESSOR_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class BucketedModel:
+    """
+    Wrap a token-classification model so every call sees one of a few fixed shapes.
+    
+    Inputs are padded (attention-masked) to COMPRESSOR_SEQ_LEN tokens and to the
+    smallest batch bucket that fits, and logits are sliced back. A torch.compile'd
+    model therefore traces once per batch bucket; larger inputs run eagerly.
+    """
+
+    def __init__(self, model, pad_token_id: int):
+        import torch
+        self._model = model
+        self._compiled = torch.compile(model, dynamic=False, fullgraph=False, mode="reduce-overhead")
+        self._pad_token_id = pad_token_id
+
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        import torch.nn.functional as F
+        batch, length = input_ids.shape
+        bucket = next((b for b in COMPRESSOR_BATCH_BUCKETS if b >= batch), None)
+        if bucket is None or length > COMPRESSOR_SEQ_LEN:
+            return self._model(input_ids=input_ids, attention_mask=attention_mask, **kwargs)
+        
+        # Pad sequence axis on the right, batch axis at the end (rows are fully masked)
+        pad = (0, COMPRESSOR_SEQ_LEN - length, 0, bucket - batch)
+        outputs = self._compiled(
+            input_ids=F.pad(input_ids, pad, value=self._pad_token_id),
+            attention_mask=F.pad(attention_mask, pad, value=0),
+            **kwargs,
+        )
+        outputs.logits = outputs.logits[:batch, :length]
+        return outputs
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
 
 
 class ContextCompressor:
     """LLMLingua-2 prompt compression."""
 
-    def __init__(self, device: str = "mps"):
+    def __init__(self, device: str = "mps", fp16: bool = True, compile_model: bool = False):
         if not HAS_LLMLINGUA:
             raise ImportError("pip install llmlingua")
         
@@ -177,6 +573,23 @@ class ContextCompressor:
             use_llmlingua2=True,
             device_map=device,
         )
+        
+        # Reduced precision: FP16 on accelerators, dynamic INT8 Linear layers on CPU
+        device_type = device.split(":")[0]
+        if fp16:
+            if device_type in ("mps", "cuda"):
+                self.compressor.model.half()
+            elif device_type == "cpu":
+                import torch
+                self.compressor.model = torch.quantization.quantize_dynamic(
+                    self.compressor.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        
+        # Opt-in: compile once per shape bucket (first call per bucket pays the trace)
+        if compile_model:
+            self.compressor.model = BucketedModel(
+                self.compressor.model, self.compressor.tokenizer.pad_token_id
+            )
 
     def compress(self, text: str, target_ratio: float = 0.5) -> dict:
         """Compress text. Returns dict with compressed_prompt, stats."""
@@ -196,27 +609,113 @@ class ContextCompressor:
                 "ratio": float(str(result["ratio"]).rstrip("x")),
             }
         
-        # Chunk and compress
+        # Chunk and compress in one batched call (LLMLingua-2 accepts a context list)
         chunks = [text[i:i+max_chars] for i in range(0, len(text), max_chars)]
-        compressed = []
-        origin_total = 0
-        compressed_total = 0
+        chunks = [c for c in chunks if c.strip()]
+        if not chunks:
+            return {"compressed_prompt": "", "origin_tokens": 0, "compressed_tokens": 0, "ratio": 1.0}
         
-        for chunk in chunks:
-            if not chunk.strip():
-                continue
-            r = self.compressor.compress_prompt(chunk, rate=target_ratio)
-            compressed.append(r["compressed_prompt"])
-            origin_total += r["origin_tokens"]
-            compressed_total += r["compressed_tokens"]
+        r = self.compressor.compress_prompt(chunks, rate=target_ratio)
+        origin_total = r["origin_tokens"]
+        compressed_total = r["compressed_tokens"]
         
         return {
-            "compressed_prompt": " ".join(compressed),
+            "compressed_prompt": " ".join(r.get("compressed_prompt_list") or [r["compressed_prompt"]]),
             "origin_tokens": origin_total,
             "compressed_tokens": compressed_total,
             "ratio": compressed_total / origin_total if origin_total else 1.0,
         }
 
+    def serve(self, port: int = DEFAULT_COMPRESSOR_PORT, host: str = "127.0.0.1"):
+        """
+        Keep the model resident and answer compress requests over HTTP.
+        
+        POST /compress {"text": str, "target_ratio": float} -> compress() result
+        GET  /health -> {"ok": true}
+        """
+        compressor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200, {"ok": True})
+                else:
+                    self._reply(404, {"error": "not found"})
+
+            def do_POST(self):
+                if self.path != "/compress":
+                    self._reply(404, {"error": "not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    req = json.loads(self.rfile.read(length))
+                    text = req["text"]
+                    target_ratio = float(req.get("target_ratio", 0.5))
+                except Exception as e:
+                    self._reply(400, {"error": f"bad request: {e}"})
+                    return
+                try:
+                    result = compressor.compress(text, target_ratio=target_ratio)
+                except Exception as e:
+                    self._reply(500, {"error": str(e)})
+                    return
+                self._reply(200, result)
+
+            def log_message(self, format, *args):
+                pass
+
+        # Single-threaded on purpose: one model, one request at a time
+        server = HTTPServer((host, port), Handler)
+        print(f"Compressor listening on http://{host}:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class RemoteCompressor:
+    """Client for a ContextCompressor.serve() process. Same compress() contract."""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def compress(self, text: str, target_ratio: float = 0.5) -> dict:
+        """Compress text on the server. Returns dict with compressed_prompt, stats."""
+        req = urllib.request.Request(
+            f"{self.url}/compress",
+            data=json.dumps({"text": text, "target_ratio": target_ratio}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise RuntimeError(f"Compressor server error {e.code}: {message}") from e
+
+    @staticmethod
+    def is_running(url: str, timeout: float = 0.2) -> bool:
+        """True if a compressor server answers /health at url."""
+        try:
+            with urllib.request.urlopen(f"{url.rstrip('/')}/health", timeout=timeout) as resp:
+                return resp.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
 
 class ContextPipeline:
     """
@@ -234,38 +733,68 @@ class ContextPipeline:
         index_dir: Optional[str] = None,
         use_compression: bool = True,
         device: str = "mps",
+        compressor_url: Optional[str] = None,
     ):
         self.workspace = Path(workspace or os.path.expanduser("~/.openclaw/workspace"))
         self.index_dir = Path(index_dir or self.workspace / ".context-index")
-        self.use_compression = use_compression and HAS_LLMLINGUA
+        self.compressor_url = compressor_url or os.environ.get(COMPRESSOR_URL_ENV)
+        self.use_compression = use_compression and (HAS_LLMLINGUA or bool(self.compressor_url))
         self._device = device
+        faiss.omp_set_num_threads(
+            int(os.environ.get(FAISS_THREADS_ENV) or os.cpu_count() or 1)
+        )
         
-        self.retriever = ContextRetriever()
+        # Double buffer: searches read _active while index_workspace builds a replacement
+        self._active = ContextRetriever()
         if self.index_dir.exists():
-            self.retriever.load(str(self.index_dir))
+            self._active.load(str(self.index_dir))
+        self._build_lock = threading.Lock()
         
-        self._compressor: Optional[ContextCompressor] = None
+        self._compressor: Optional[ContextCompressor | RemoteCompressor] = None
 
     @property
-    def compressor(self) -> ContextCompressor:
-        """Lazy-load compressor."""
+    def compressor(self) -> "ContextCompressor | RemoteCompressor":
+        """Lazy-load compressor, or connect to a warm server if one is configured."""
         if self._compressor is None:
-            self._compressor = ContextCompressor(device=self._device)
+            if self.compressor_url:
+                self._compressor = RemoteCompressor(self.compressor_url)
+            else:
+                self._compressor = ContextCompressor(device=self._device)
         return self._compressor
 
+    @property
+    def retriever(self) -> ContextRetriever:
+        """Retriever currently serving searches."""
+        return self._active
+
     def index_workspace(
         self,
         extensions: tuple[str, ...] = (".md", ".txt", ".py"),
         force: bool = False,
     ) -> dict:
-        """Index workspace files."""
-        chunks = self.retriever.index_directory(str(self.workspace), extensions, force)
-        self.retriever.save(str(self.index_dir))
+        """
+        Index workspace files.
+        
+        Builds into a separate retriever and swaps it in when done, so searches
+        never wait on indexing. The new retriever is seeded from the saved index
+        (not from the active one), so unsaved changes made directly through
+        ``retriever.index_file`` are dropped unless ``retriever.save`` was called.
+        """
+        with self._build_lock:
+            building = ContextRetriever()
+            if not force and self.index_dir.exists():
+                building.load(str(self.index_dir))
+            
+            chunks = building.index_directory(str(self.workspace), extensions, force)
+            building.save(str(self.index_dir))
+            
+            # A single attribute rebind: readers see the old or new retriever, never a mix
+            self._active = building
         
         return {
             "chunks_added": chunks,
-            "total_chunks": self.retriever.index.ntotal,
-            "files": len(self.retriever.file_hashes),
+            "total_chunks": building.index.ntotal - len(building._tombstones),
+            "files": len(building.file_hashes),
         }
 
     def get_context(
@@ -307,9 +836,17 @@ class ContextPipeline:
         
         should_compress = compress if compress is not None else self.use_compression
         
+        # Compression is the most expensive step; skip it when already within budget
+        est_tokens = len(combined) // 4
+        if should_compress and est_tokens <= max_tokens:
+            return {
+                "context": combined,
+                "sources": sources,
+                "stats": {"origin_tokens": est_tokens, "compressed_tokens": est_tokens, "ratio": 1.0, "savings_pct": 0},
+            }
+        
         if should_compress:
             # Estimate target ratio
-            est_tokens = len(combined) / 4
             target = min(0.9, max_tokens / est_tokens) if est_tokens else 0.5
             
             result = self.compressor.compress(combined, target_ratio=target)
@@ -344,6 +881,15 @@ if __name__ == "__main__":
     args = sys.argv[1:]
     if not args or args[0] in ("-h", "--help"):
         print("Usage: python pipeline.py <query> [--compress] [-k N]")
+        print("       python pipeline.py --serve [--port N] [--device DEV] [--compile]")
+        sys.exit(0)
+    
+    if args[0] == "--serve":
+        port = DEFAULT_COMPRESSOR_PORT
+        if "--port" in args:
+            port = int(args[args.index("--port") + 1])
+        device = args[args.index("--device") + 1] if "--device" in args else "mps"
+        ContextCompressor(device=device, compile_model="--compile" in args).serve(port=port)
         sys.exit(0)
     
     query = args[0]
@@ -352,7 +898,14 @@ if __name__ == "__main__":
     if "-k" in args:
         k = int(args[args.index("-k") + 1])
     
-    p = ContextPipeline(use_compression=compress)
+    # Prefer a warm compressor server over loading the model in this process
+    compressor_url = os.environ.get(COMPRESSOR_URL_ENV)
+    if compress and not compressor_url:
+        local = f"http://127.0.0.1:{DEFAULT_COMPRESSOR_PORT}"
+        if RemoteCompressor.is_running(local):
+            compressor_url = local
+    
+    p = ContextPipeline(use_compression=compress, compressor_url=compressor_url)
     
     if p.retriever.index.ntotal == 0:
         print("Indexing workspace...")